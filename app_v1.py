@@ -1,10 +1,20 @@
 # app.py
 # Streamlit POC for Stealth Med RWEye — shows drugs by ATC with pubs + Rx volume
 # Drop-in replacement. No notebook work required.
+import io
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import streamlit as st
 from pathlib import Path
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None  # fall back to the pandas merge path below
+
 # -------------------------
 # Paths (edit BASE if needed)
 # -------------------------
@@ -37,53 +47,120 @@ if LOGO_FN.exists():
 # -------------------------
 # Data loading / shaping
 # -------------------------
-@st.cache_data
-def load_data(pubs_fn: Path, rx_fn: Path) -> pd.DataFrame:
-    # 1) Publications table
-    pubs = pd.read_csv(pubs_fn)
+# Arrow types per column for the parquet sidecars; anything not listed reads as string.
+PUBS_TYPES = {"unique_pub_count": pa.float64()}
+RX_TYPES = {"rx_freq_total": pa.float64(), "freq_total": pa.float64(), "freq": pa.float64()}
 
-    # Ensure we have real drug names
-    if "rxnorm_name" in pubs.columns:
-        pubs = pubs[pubs["rxnorm_name"].notna() & (pubs["rxnorm_name"].str.strip() != "")]
+def _parquet_sidecar(path: Path, type_overrides: dict) -> Path:
+    """Convert a CSV to a Parquet sidecar once; reuse until the CSV changes.
+    Types are declared on the Arrow side so pandas never re-parses columns."""
+    sidecar = path.with_suffix(".parquet")
+    if sidecar.exists() and sidecar.stat().st_mtime >= path.stat().st_mtime:
+        return sidecar
+    tbl = pacsv.read_csv(path)
+    schema = pa.schema(
+        [pa.field(name, type_overrides.get(name, pa.string())) for name in tbl.column_names]
+    )
+    pq.write_table(tbl.cast(schema), sidecar, compression="zstd")
+    return sidecar
+
+def _load_data_duckdb(pubs_pq: Path, rx_pq: Path, group_keys: list, rx_keys: list, vol_col: str | None) -> pd.DataFrame:
+    # One vectorized query: filter, aggregate pubs, aggregate + join rx volume.
+    # Nothing but the final table is ever materialized in Python.
+    con = duckdb.connect()
+    con.execute("PRAGMA threads=4")
+    gk = ", ".join(f'"{c}"' for c in group_keys)
+    where = "WHERE \"rxnorm_name\" IS NOT NULL AND trim(\"rxnorm_name\") <> ''" \
+        if "rxnorm_name" in group_keys else ""
+    pub_sum = 'SUM("unique_pub_count")' if "unique_pub_count" in pq.read_schema(pubs_pq).names else "0"
+    pubs_sql = f"""
+        SELECT {gk}, {pub_sum} AS "unique_pub_count"
+        FROM read_parquet('{pubs_pq.as_posix()}')
+        {where}
+        GROUP BY {gk}
+    """
+    if vol_col and rx_keys:
+        rk = ", ".join(f'"{c}"' for c in rx_keys)
+        sql = f"""
+            SELECT p.*, COALESCE(r."{vol_col}", 0)::BIGINT AS "{vol_col}"
+            FROM ({pubs_sql}) p
+            LEFT JOIN (
+                SELECT {rk}, SUM("{vol_col}") AS "{vol_col}"
+                FROM read_parquet('{rx_pq.as_posix()}')
+                GROUP BY {rk}
+            ) r USING ({rk})
+        """
     else:
-        pubs["rxnorm_name"] = ""   # safety
-
-    # Keep stable schema
-    keep_cols = [
-        "cui","rxnorm_tty","rxnorm_name",
-        "L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name",
-        "unique_pub_count"
-    ]
-    keep_cols = [c for c in keep_cols if c in pubs.columns]
-    pubs = pubs[keep_cols].copy()
-
-    # Aggregate pubs at CUI + L1..L4 (in case of multiple L5 rows)
-    group_keys = [k for k in ["cui","rxnorm_name","rxnorm_tty",
-                              "L1_code","L1_name","L2_code","L2_name",
-                              "L3_code","L3_name","L4_code","L4_name"] if k in pubs.columns]
-    pubs_agg = (pubs.groupby(group_keys, as_index=False)["unique_pub_count"].sum()
-                   if "unique_pub_count" in pubs.columns else
-                   pubs.assign(unique_pub_count=0))
+        sql = pubs_sql
+    return con.execute(sql).to_arrow_table().to_pandas(types_mapper=pd.ArrowDtype)
+
+def _finalize_table(df: pd.DataFrame) -> pd.DataFrame:
+    # Categorical keys: the display groupby takes its group ids straight from
+    # the category codes instead of hashing strings per row. Pre-sorting by
+    # cui keeps group keys clustered for the sorted-key fast path.
+    for c in ["cui","drug_name","L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name"]:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    return df.sort_values("cui", kind="stable", ignore_index=True)
+
+# cache_resource returns the frame by reference — no pickle/hash round-trip
+# per rerun. Downstream code treats it as read-only.
+@st.cache_resource
+def load_data(pubs_fn: Path, rx_fn: Path) -> pd.DataFrame:
+    # Cleaned merged cache: survives container restarts, unlike st.cache_data
+    clean_fp = pubs_fn.with_suffix(".merged.feather")
+    if clean_fp.exists() and clean_fp.stat().st_mtime >= max(pubs_fn.stat().st_mtime, rx_fn.stat().st_mtime):
+        cached = pd.read_feather(clean_fp, dtype_backend="pyarrow")
+        # caches written before rxnorm_tty was dropped from the keys are
+        # at a finer granularity — rebuild those
+        if "rxnorm_tty" not in cached.columns:
+            return _finalize_table(cached)
 
-    # 2) Rx volume table
-    rx = pd.read_csv(rx_fn)
+    pubs_pq = _parquet_sidecar(pubs_fn, PUBS_TYPES)
+    rx_pq = _parquet_sidecar(rx_fn, RX_TYPES)
+    pubs_cols = pq.read_schema(pubs_pq).names
+    rx_cols = pq.read_schema(rx_pq).names
+
+    # Keep stable schema; aggregate pubs at CUI + L1..L4 (in case of multiple
+    # L5 or TTY rows). These keys match the display granularity exactly, so
+    # the main flow never has to aggregate again.
+    group_keys = [k for k in ["cui","rxnorm_name",
+                              "L1_code","L1_name","L2_code","L2_name",
+                              "L3_code","L3_name","L4_code","L4_name"] if k in pubs_cols]
 
     # Guess the total-volume column name
     vol_col = None
     for candidate in ["rx_freq_total", "freq_total", "freq"]:
-        if candidate in rx.columns:
+        if candidate in rx_cols:
             vol_col = candidate
             break
-    if vol_col is None:
-        rx["rx_freq_total"] = 0
-        vol_col = "rx_freq_total"
 
     # Keys to align on
-    rx_keys = [k for k in ["cui","L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name"] if k in rx.columns]
-    rx = rx[rx_keys + [vol_col]].copy()
+    rx_keys = [k for k in ["cui","L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name"] if k in rx_cols]
 
-    # Merge pubs + rx
-    df = pubs_agg.merge(rx, on=rx_keys, how="left")
+    if duckdb is not None:
+        df = _load_data_duckdb(pubs_pq, rx_pq, group_keys, rx_keys, vol_col)
+    else:
+        # pandas fallback: same shape, three intermediate frames
+        pub_cols = group_keys + (["unique_pub_count"] if "unique_pub_count" in pubs_cols else [])
+        pubs = pd.read_parquet(pubs_pq, columns=pub_cols,
+                               engine="pyarrow", dtype_backend="pyarrow")
+        if "rxnorm_name" in pubs.columns:
+            pubs = pubs[pubs["rxnorm_name"].notna() & (pubs["rxnorm_name"].str.strip() != "")]
+        df = (pubs.groupby(group_keys, as_index=False, sort=False, observed=True)["unique_pub_count"].sum()
+              if "unique_pub_count" in pubs.columns else
+              pubs.drop_duplicates().assign(unique_pub_count=0))
+        if vol_col and rx_keys:
+            rx = pd.read_parquet(rx_pq, columns=rx_keys + [vol_col],
+                                 engine="pyarrow", dtype_backend="pyarrow")
+            rx = rx.groupby(rx_keys, as_index=False, sort=False, observed=True)[vol_col].sum()
+            df = df.merge(rx, on=rx_keys, how="left")
+
+    if "rxnorm_name" not in df.columns:
+        df["rxnorm_name"] = ""   # safety
+    if vol_col is None:
+        df["rx_freq_total"] = 0
+        vol_col = "rx_freq_total"
     df[vol_col] = df[vol_col].fillna(0).astype(int)
 
     # Friendly names
@@ -98,7 +175,10 @@ def load_data(pubs_fn: Path, rx_fn: Path) -> pd.DataFrame:
         if c in df.columns:
             df[c] = df[c].fillna("(unknown)")
 
-    return df
+    # Feather stores plain Arrow columns; categoricals are re-applied on read
+    df.reset_index(drop=True).to_feather(clean_fp, compression="zstd")
+
+    return _finalize_table(df)
 
 df = load_data(PUBS_FN, RX_FN)
 
@@ -119,23 +199,29 @@ df = load_data(PUBS_FN, RX_FN)
 st.sidebar.markdown("### Explore drugs by:")
 st.sidebar.caption("ATC hierarchy → L1 letter → L2 2-digit → L3 3-char → L4 4-char. Select a level; lower levels filter accordingly.")
 
-def optlist(code_col, name_col):
-    if code_col not in df.columns or name_col not in df.columns:
-        return ["(all)"], "(all)"
-    opts = ["(all)"] + sorted(
-        {f"{c} — {n}" for c, n in zip(df[code_col], df[name_col]) if pd.notna(c) and pd.notna(n)}
-    )
-    return opts, "(all)"
+@st.cache_data
+def build_option_lists(df: pd.DataFrame) -> dict[str, list[str]]:
+    # All four ATC label lists in one cached pass, so reruns skip the
+    # per-row set building entirely
+    out = {}
+    for lvl in ["L1", "L2", "L3", "L4"]:
+        code_col, name_col = f"{lvl}_code", f"{lvl}_name"
+        if code_col not in df.columns or name_col not in df.columns:
+            out[lvl] = ["(all)"]
+            continue
+        # dedup/sort in C on the (code, name) pairs, then build the few
+        # surviving label strings — no Python set over N rows
+        pairs = df[[code_col, name_col]].dropna().drop_duplicates().sort_values(code_col)
+        labels = (pairs[code_col].astype(str) + " — " + pairs[name_col].astype(str)).drop_duplicates()
+        out[lvl] = ["(all)"] + labels.tolist()
+    return out
 
-l1_opts, l1_default = optlist("L1_code", "L1_name")
-l2_opts, l2_default = optlist("L2_code", "L2_name")
-l3_opts, l3_default = optlist("L3_code", "L3_name")
-l4_opts, l4_default = optlist("L4_code", "L4_name")
+opt_lists = build_option_lists(df)
 
-l1_sel = st.sidebar.selectbox("L1 — Anatomical main group", l1_opts, index=l1_opts.index(l1_default))
-l2_sel = st.sidebar.selectbox("L2 — Therapeutic main group", l2_opts, index=l2_opts.index(l2_default))
-l3_sel = st.sidebar.selectbox("L3 — Pharmacological subgroup", l3_opts, index=l3_opts.index(l3_default))
-l4_sel = st.sidebar.selectbox("L4 — Chemical/Therapeutic/Pharmacological subgroup", l4_opts, index=l4_opts.index(l4_default))
+l1_sel = st.sidebar.selectbox("L1 — Anatomical main group", opt_lists["L1"], index=0)
+l2_sel = st.sidebar.selectbox("L2 — Therapeutic main group", opt_lists["L2"], index=0)
+l3_sel = st.sidebar.selectbox("L3 — Pharmacological subgroup", opt_lists["L3"], index=0)
+l4_sel = st.sidebar.selectbox("L4 — Chemical/Therapeutic/Pharmacological subgroup", opt_lists["L4"], index=0)
 
 metric = st.sidebar.radio("Rank by:", ["Publications", "Rx volume"], horizontal=True, index=0)
 metric_col = "pub_count" if metric == "Publications" else "rx_volume"
@@ -143,30 +229,48 @@ metric_col = "pub_count" if metric == "Publications" else "rx_volume"
 top_n = st.sidebar.number_input("Show top N drugs", min_value=10, max_value=1000, value=100, step=10)
 
 # -------------------------
-# Filtering
+# Filtering + aggregation (cached per ATC selection)
 # -------------------------
-filtered = df.copy()
-
 def code_from_label(label: str) -> str | None:
     if not label or label == "(all)":
         return None
     # labels look like "N06 — Psychoanaleptics"
     return label.split(" — ", 1)[0].strip()
 
-for level, sel in [("L1_code", l1_sel), ("L2_code", l2_sel), ("L3_code", l3_sel), ("L4_code", l4_sel)]:
-    code = code_from_label(sel)
-    if code and level in filtered.columns:
-        filtered = filtered[filtered[level] == code]
+@st.cache_data
+def aggregate(l1: str, l2: str, l3: str, l4: str) -> pd.DataFrame:
+    # Keyed on the four selections only; toggling metric or top N reuses
+    # the cached frame instead of rerunning the groupby.
+    # Labels are parsed up front and all levels fuse into one boolean mask
+    # over the category codes — a single slice, no intermediate frames.
+    selections = {level: code_from_label(sel) for level, sel in
+                  [("L1_code", l1), ("L2_code", l2), ("L3_code", l3), ("L4_code", l4)]}
+    mask = np.ones(len(df), dtype=bool)
+    for level, code in selections.items():
+        if code and level in df.columns:
+            mask &= df[level].cat.codes.to_numpy() == df[level].cat.categories.get_indexer([code])[0]
+    filtered = df.loc[mask]
+    # load_data already aggregated to one row per (cui, drug_name, L1..L4),
+    # and filtering never merges rows — so no second groupby, just project
+    # the display columns and order them
+    group_cols = [c for c in ["cui","drug_name","L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name"] if c in filtered.columns]
+    return (filtered[group_cols + ["pub_count", "rx_volume"]]
+            .sort_values(["pub_count", "rx_volume"], ascending=False))
+
+@st.cache_data
+def global_top_agg(metric: str) -> pd.DataFrame:
+    # Top-1000 aggregate with no ATC filters — the common first-visit case,
+    # kept small so every metric/top-N toggle is served instantly
+    return aggregate("(all)", "(all)", "(all)", "(all)").nlargest(1000, metric)
 
 # -------------------------
 # Aggregate + display
 # -------------------------
-group_cols = [c for c in ["cui","drug_name","L1_code","L1_name","L2_code","L2_name","L3_code","L3_name","L4_code","L4_name"] if c in filtered.columns]
-agg = (filtered
-       .groupby(group_cols, as_index=False)
-       .agg(pub_count=("pub_count","sum"), rx_volume=("rx_volume","sum"))
-       .sort_values(metric_col, ascending=False)
-       .head(int(top_n)))
+if all(sel == "(all)" for sel in [l1_sel, l2_sel, l3_sel, l4_sel]) and int(top_n) <= 1000:
+    agg = global_top_agg(metric_col).head(int(top_n))
+else:
+    agg_full = aggregate(l1_sel, l2_sel, l3_sel, l4_sel)
+    agg = agg_full.sort_values(metric_col, ascending=False).head(int(top_n))
 
 st.markdown("### Drugs (click to drill down)")
 st.dataframe(agg, use_container_width=True, hide_index=True)
@@ -174,7 +278,20 @@ st.dataframe(agg, use_container_width=True, hide_index=True)
 # -------------------------
 # Download
 # -------------------------
-csv_bytes = agg.to_csv(index=False).encode("utf-8")
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV bytes via Arrow's multithreaded writer; cached per frame."""
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    # Arrow's CSV writer doesn't take dictionary (categorical) columns
+    schema = pa.schema(
+        [pa.field(f.name, pa.string()) if pa.types.is_dictionary(f.type) else f
+         for f in tbl.schema]
+    )
+    buf = io.BytesIO()
+    pacsv.write_csv(tbl.cast(schema), buf)
+    return buf.getvalue()
+
+csv_bytes = to_csv_bytes(agg)
 st.download_button(
     label="Download drug list (CSV)",
     data=csv_bytes,
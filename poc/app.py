@@ -1,12 +1,21 @@
 # app.py — cloud-safe header: paths, logo, loaders, file resolution
+import io
 import os
 import re
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import streamlit as st
 from datetime import datetime
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None  # ADE lookups fall back to the indexed-pandas path
+
 # -----------------------
 # Page config
 # -----------------------
@@ -84,40 +93,132 @@ PRR_PATH = resolve_file("prr3.csv", "PRR3_CSV")
 # -----------------------
 # Loaders
 # -----------------------
-@st.cache_data(show_spinner=True)
+# Columns each table actually uses downstream; the parquet reads below only
+# materialize these, everything else stays on disk.
+SMR_COLS = ["drug", "agegroup", "l1", "l2", "l3", "l4", "cui", "prescriptions", "pubs", "is_first"]
+PRR_COLS = ["drug", "cui", "agegroup", "pt", "prr", "ror", "ic", "ebgm"]
+
+# Arrow types per (lowercased) column; anything not listed is read as string.
+SMR_TYPES = {"prescriptions": pa.float64(), "pubs": pa.float64(), "is_first": pa.float64()}
+PRR_TYPES = {"prr": pa.float64(), "ror": pa.float64(), "ic": pa.float64(), "ebgm": pa.float64()}
+
+def _parquet_sidecar(path: Path, type_overrides: dict) -> Path:
+    """Convert `path` (a CSV) to a Parquet sidecar once; reuse until the CSV changes.
+    Types are declared on the Arrow side so pandas never re-parses columns."""
+    sidecar = path.with_suffix(".parquet")
+    if sidecar.exists() and sidecar.stat().st_mtime >= path.stat().st_mtime:
+        return sidecar
+    tbl = pacsv.read_csv(path)
+    schema = pa.schema(
+        [pa.field(name, type_overrides.get(name.strip().lower(), pa.string()))
+         for name in tbl.column_names]
+    )
+    pq.write_table(tbl.cast(schema), sidecar, compression="zstd")
+    return sidecar
+
+def _clean_cache(pathlike) -> Path | None:
+    """Feather cache of the fully cleaned frame next to the CSV, or None if
+    the cache is missing/stale (or the input is an uploaded file-like)."""
+    if not isinstance(pathlike, (str, Path)):
+        return None
+    return Path(pathlike).with_suffix(".clean.feather")
+
+def _clean_cache_fresh(cache_fp: Path | None, pathlike) -> bool:
+    return (cache_fp is not None and cache_fp.exists()
+            and cache_fp.stat().st_mtime >= Path(pathlike).stat().st_mtime)
+
+# cache_resource, not cache_data: the frames are returned by reference and
+# treated as read-only downstream, skipping the pickle/hash round-trip that
+# cache_data does on every retrieval
+@st.cache_resource(show_spinner=True)
 def load_smr(pathlike) -> pd.DataFrame:
-    df = pd.read_csv(pathlike, dtype=str)
-    df.columns = [c.strip().lower() for c in df.columns]
-
-    for c in ["drug", "agegroup", "l1", "l2", "l3", "l4", "cui"]:
-        if c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-
-    for c in ["prescriptions", "pubs", "is_first"]:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-
-    if "is_first" in df.columns:
-        df = df[df["is_first"] == 1]
-
-    for c in ["l1", "l2", "l3", "l4"]:
+    # Cleaned feather cache: st.cache_data dies with the process, this doesn't
+    cache_fp = _clean_cache(pathlike)
+    if _clean_cache_fresh(cache_fp, pathlike):
+        df = pd.read_feather(cache_fp, dtype_backend="pyarrow")
+    else:
+        if isinstance(pathlike, (str, Path)):
+            sidecar = _parquet_sidecar(Path(pathlike), SMR_TYPES)
+            have = pq.read_schema(sidecar).names
+            df = pd.read_parquet(sidecar, engine="pyarrow", dtype_backend="pyarrow",
+                                 columns=[c for c in have if c.strip().lower() in SMR_COLS])
+            df.columns = [c.strip().lower() for c in df.columns]
+        else:
+            # Uploaded file-like object: nowhere to put a sidecar. Peek at the
+            # header, then let the multithreaded pyarrow CSV engine read only
+            # the needed columns straight into Arrow buffers.
+            wanted = [c for c in pd.read_csv(pathlike, nrows=0).columns if c.strip().lower() in SMR_COLS]
+            pathlike.seek(0)
+            df = pd.read_csv(pathlike, engine="pyarrow", usecols=wanted, dtype_backend="pyarrow")
+            df.columns = [c.strip().lower() for c in df.columns]
+
+        # Arrow-backed string columns: strip runs as a vectorized kernel, not per-cell
+        for c in ["drug", "agegroup", "l1", "l2", "l3", "l4", "cui"]:
+            if c in df.columns:
+                df[c] = df[c].str.strip()
+
+        if "is_first" in df.columns:
+            df = df[df["is_first"] == 1]
+
+        for c in ["l1", "l2", "l3", "l4"]:
+            if c in df.columns:
+                df[c] = df[c].replace({"": np.nan, "nan": np.nan})
+
+        if cache_fp is not None:
+            df.reset_index(drop=True).to_feather(cache_fp, compression="zstd")
+
+    # Categoricals: the sidebar filters then compare integer codes over
+    # contiguous memory instead of string arrays. Applied after the cache
+    # round-trip so feather only ever stores plain Arrow strings.
+    for c in ["l1", "l2", "l3", "l4", "agegroup", "drug"]:
         if c in df.columns:
-            df[c] = df[c].replace({"": np.nan, "nan": np.nan})
+            df[c] = df[c].astype("category")
 
     return df
 
-@st.cache_data(show_spinner=True)
+@st.cache_resource(show_spinner=True)
 def load_prr(pathlike) -> pd.DataFrame:
-    df = pd.read_csv(pathlike, dtype=str)
-    df.columns = [c.strip().lower() for c in df.columns]
+    cache_fp = _clean_cache(pathlike)
+    if _clean_cache_fresh(cache_fp, pathlike):
+        return pd.read_feather(cache_fp, dtype_backend="pyarrow")
+
+    if isinstance(pathlike, (str, Path)):
+        sidecar = _parquet_sidecar(Path(pathlike), PRR_TYPES)
+        have = pq.read_schema(sidecar).names
+        df = pd.read_parquet(sidecar, engine="pyarrow", dtype_backend="pyarrow",
+                             columns=[c for c in have if c.strip().lower() in PRR_COLS])
+        df.columns = [c.strip().lower() for c in df.columns]
+    else:
+        wanted = [c for c in pd.read_csv(pathlike, nrows=0).columns if c.strip().lower() in PRR_COLS]
+        pathlike.seek(0)
+        df = pd.read_csv(pathlike, engine="pyarrow", usecols=wanted, dtype_backend="pyarrow")
+        df.columns = [c.strip().lower() for c in df.columns]
     for c in ["drug", "cui", "agegroup", "pt"]:
         if c in df.columns:
-            df[c] = df[c].astype(str).str.strip()
-    for c in ["prr", "ror", "ic", "ebgm"]:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
+            df[c] = df[c].str.strip()
+    # Precomputed once here so the ADE fallback lookup is a plain equality,
+    # not a per-rerun casefold over the whole column
+    if "drug" in df.columns:
+        df["drug_lower"] = df["drug"].str.casefold()
+
+    if cache_fp is not None:
+        df.reset_index(drop=True).to_feather(cache_fp, compression="zstd")
     return df
 
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV bytes via Arrow's multithreaded writer; cached so unrelated widget
+    toggles don't rebuild the download payload."""
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    # Arrow's CSV writer doesn't take dictionary (categorical) columns
+    schema = pa.schema(
+        [pa.field(f.name, pa.string()) if pa.types.is_dictionary(f.type) else f
+         for f in tbl.schema]
+    )
+    buf = io.BytesIO()
+    pacsv.write_csv(tbl.cast(schema), buf)
+    return buf.getvalue()
+
 def load_or_upload(label: str, path_obj: Path | None, fn):
     if path_obj is not None:
         try:
@@ -134,10 +235,14 @@ def load_or_upload(label: str, path_obj: Path | None, fn):
 
 # ---- actually load the data (or prompt for upload)
 smr, smr_src = load_or_upload("smr3.csv", SMR_PATH, load_smr)
-prr, prr_src = load_or_upload("prr3.csv", PRR_PATH, load_prr)
-if smr.empty or prr.empty:
+if smr.empty:
     st.stop()
 
+def get_prr():
+    # Deferred: prr is the larger file and only the ADE drill-down reads it,
+    # so it is loaded (once — load_prr is cached) on first drug selection
+    return load_or_upload("prr3.csv", PRR_PATH, load_prr)
+
 
 # -----------------------
 # Sidebar Navigation (filters)
@@ -155,22 +260,67 @@ age_choice = st.sidebar.radio("Age Categories", age_available, index=0)
 sort_metric = st.sidebar.radio("Sort by", ["Prescriptions", "Publications"], index=0)
 sort_desc = st.sidebar.checkbox("Sort descending", value=True)
 
-def opts(series: pd.Series):
-    vals = [x for x in series.dropna().unique().tolist() if str(x).strip() != ""]
-    return ["All"] + sorted(vals)
+@st.cache_resource(show_spinner=False)
+def presort_smr(df: pd.DataFrame) -> dict:
+    """smr pre-sorted once per (metric, direction). Boolean-mask filtering
+    preserves row order, so reruns never call sort_values. Each direction is
+    its own sort (not a reversed view) so NaN metrics stay last either way."""
+    return {
+        (metric, ascending): df.sort_values(col, ascending=ascending, kind="stable", na_position="last")
+        for metric, col in [("Prescriptions", "prescriptions"), ("Publications", "pubs")]
+        for ascending in (False, True)
+    }
+
+# All masks below are built on (and applied to) the pre-sorted base
+smr_base = presort_smr(smr)[(sort_metric, not sort_desc)]
+
+@st.cache_data(show_spinner=False)
+def build_atc_tree(df: pd.DataFrame) -> dict:
+    """Nested {l1: {l2: {l3: [l4, ...]}}} built once per cached frame, so each
+    cascading selectbox populates from dict lookups instead of re-slicing df."""
+    cols = [c for c in ["l1", "l2", "l3", "l4"] if c in df.columns]
+    tree: dict = {}
+    if len(cols) < 4:
+        return tree
+    for l1, l2, l3, l4 in df[cols].dropna().drop_duplicates().itertuples(index=False):
+        tree.setdefault(l1, {}).setdefault(l2, {}).setdefault(l3, set()).add(l4)
+    for d1 in tree.values():
+        for d2 in d1.values():
+            for k3 in d2:
+                d2[k3] = sorted(d2[k3])
+    return tree
+
+def tree_opts(tree: dict, picks: list) -> list:
+    """Options for the ATC level below `picks` ('All' = no constraint above)."""
+    nodes = [tree]
+    for pick in picks:
+        nxt = []
+        for node in nodes:
+            if pick == "All":
+                nxt.extend(node.values())
+            elif pick in node:
+                nxt.append(node[pick])
+        nodes = nxt
+    out: set = set()
+    for node in nodes:
+        out.update(node if isinstance(node, list) else node.keys())
+    return ["All"] + sorted(out)
+
+atc_tree = build_atc_tree(smr)
 
 # Cascading ATC (use the full string from smr3, e.g., "J05, ANTIVIRALS FOR SYSTEMIC USE")
-l1_choice = st.sidebar.selectbox("Anatomical main group (ATC L1)", opts(smr["l1"]) if "l1" in smr.columns else ["All"])
-smr_l1 = smr if l1_choice == "All" else smr[smr["l1"] == l1_choice]
-
-l2_choice = st.sidebar.selectbox("Therapeutic main group (ATC L2)", opts(smr_l1["l2"]) if "l2" in smr_l1.columns else ["All"])
-smr_l2 = smr_l1 if l2_choice == "All" else smr_l1[smr_l1["l2"] == l2_choice]
-
-l3_choice = st.sidebar.selectbox("Pharmacological subgroup (ATC L3)", opts(smr_l2["l3"]) if "l3" in smr_l2.columns else ["All"])
-smr_l3 = smr_l2 if l3_choice == "All" else smr_l2[smr_l2["l3"] == l3_choice]
-
-l4_choice = st.sidebar.selectbox("Chemical subgroup (ATC L4)", opts(smr_l3["l4"]) if "l4" in smr_l3.columns else ["All"])
-smr_filtered = smr_l3 if l4_choice == "All" else smr_l3[smr_l3["l4"] == l4_choice]
+l1_choice = st.sidebar.selectbox("Anatomical main group (ATC L1)", tree_opts(atc_tree, []))
+l2_choice = st.sidebar.selectbox("Therapeutic main group (ATC L2)", tree_opts(atc_tree, [l1_choice]))
+l3_choice = st.sidebar.selectbox("Pharmacological subgroup (ATC L3)", tree_opts(atc_tree, [l1_choice, l2_choice]))
+l4_choice = st.sidebar.selectbox("Chemical subgroup (ATC L4)", tree_opts(atc_tree, [l1_choice, l2_choice, l3_choice]))
+
+# Fuse all four level filters into one boolean mask over the category codes —
+# one allocation, no smr_l1/smr_l2/smr_l3 intermediates
+atc_mask = np.ones(len(smr_base), dtype=bool)
+for col, val in [("l1", l1_choice), ("l2", l2_choice), ("l3", l3_choice), ("l4", l4_choice)]:
+    if val != "All" and col in smr_base.columns:
+        atc_mask &= smr_base[col].cat.codes.to_numpy() == smr_base[col].cat.categories.get_loc(val)
+smr_filtered = smr_base.loc[atc_mask]
 
 # Use smr_filtered to populate search picks
 # Drug search (autocomplete)
@@ -188,32 +338,29 @@ selected_optional = st.sidebar.multiselect("Select ATCs", options=optional_atc_c
 # -----------------------
 # Apply filters
 # -----------------------
-df = smr_filtered.copy()
-df = df[df["agegroup"] == age_choice]
+# Age and drug picks fold into the same code-level mask as the ATC levels,
+# so the whole cascade costs a single slice
+mask = atc_mask.copy()
+age_code = smr_base["agegroup"].cat.categories.get_indexer([age_choice])[0]
+mask &= smr_base["agegroup"].cat.codes.to_numpy() == age_code
 if search_pick:
-    df = df[df["drug"].isin(search_pick)]
-
-# Base display fields
-df["Prescriptions"] = df["prescriptions"]
-
-def pubs_display(val):
-    # Show "No Pubs in MPRINT" if missing/zero; otherwise show comma-separated integer
-    try:
-        if pd.isna(val) or float(val) == 0.0:
-            return "No Pubs in MPRINT"
-        v = float(val)
-        return f"{int(round(v)):,}"
-    except Exception:
-        return str(val)
-
-df["Publications_num"] = df["pubs"]
-df["Publications"] = df["pubs"].apply(pubs_display)
-
-# Sort
-if sort_metric == "Publications":
-    df = df.sort_values(by="Publications_num", ascending=not sort_desc, na_position="last")
-else:
-    df = df.sort_values(by="Prescriptions", ascending=not sort_desc, na_position="last")
+    picked_codes = smr_base["drug"].cat.categories.get_indexer(search_pick)
+    picked_codes = picked_codes[picked_codes >= 0]  # -1 would match NaN rows
+    mask &= np.isin(smr_base["drug"].cat.codes.to_numpy(), picked_codes)
+df = smr_base.loc[mask]
+
+# Base display fields. Publications shows "No Pubs in MPRINT" if missing/zero,
+# otherwise a comma-separated integer — one vectorized pass, no per-row apply.
+# assign() adds the columns on a shallow copy, so the filtered slice (and the
+# cached base frame behind it) is never mutated and never deep-copied.
+vals = pd.to_numeric(df["pubs"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+no_pubs = np.isnan(vals) | (vals == 0.0)
+formatted = pd.Series(np.nan_to_num(vals).round().astype(np.int64), index=df.index).map("{:,}".format)
+df = df.assign(
+    Prescriptions=df["prescriptions"],
+    Publications_num=df["pubs"],
+    Publications=np.where(no_pubs, "No Pubs in MPRINT", formatted),
+)
 
 # -----------------------
 # Results (logo + table + CSV download)
@@ -232,7 +379,7 @@ ts = datetime.now().strftime("%Y%m%d_%H%M%S")
 res_fname = f"rweeye_results_{age_choice.replace(' ', '_')}_{ts}.csv"
 st.download_button(
     label="⬇️ Download results CSV",
-    data=results_df.to_csv(index=False).encode("utf-8"),
+    data=to_csv_bytes(results_df),
     file_name=res_fname,
     mime="text/csv",
 )
@@ -240,90 +387,131 @@ st.download_button(
 # -----------------------
 # ADE drill-down (dropdown selection) + CSV download
 # -----------------------
-st.markdown("---")
-st.markdown("### Adverse Drug Event (ADE) metrics")
-st.caption("Choose a drug from below for its ADE metrics")
+@st.cache_data(show_spinner=False)
+def build_drug_cui_map(df: pd.DataFrame) -> dict:
+    """drug -> first non-null CUI, built once so the ADE lookup is a dict get
+    instead of a full-column scan per click."""
+    pairs = df.dropna(subset=["cui"]).drop_duplicates("drug")
+    return dict(zip(pairs["drug"], pairs["cui"]))
+
+@st.cache_data(show_spinner=False)
+def index_prr(df: pd.DataFrame) -> pd.DataFrame:
+    """prr indexed by (cui, agegroup) so the ADE filter is an index slice,
+    not two boolean masks over the whole table."""
+    return df.set_index(["cui", "agegroup"]).sort_index()
+
+@st.cache_resource(show_spinner=False)
+def ade_lookup_con(prr_df: pd.DataFrame):
+    """In-memory DuckDB table over prr with a (cui, agegroup) index, so each
+    ADE lookup is an index fetch of just the matching rows."""
+    con = duckdb.connect(":memory:")
+    con.register("prr_src", prr_df)
+    con.execute("CREATE TABLE prr_t AS SELECT * FROM prr_src")
+    con.execute("CREATE INDEX prr_idx ON prr_t(cui, agegroup)")
+    con.unregister("prr_src")
+    return con
+
+# A fragment: picking a drug reruns only this panel, not the whole script
+@st.fragment
+def render_ade_panel(results_df: pd.DataFrame, age_choice: str, ts: str):
+    st.markdown("### Adverse Drug Event (ADE) metrics")
+    st.caption("Choose a drug from below for its ADE metrics")
+
+    visible_drugs = results_df["drug"].dropna().unique().tolist()
+    pick = st.selectbox("Druglist", ["(None)"] + visible_drugs)
+    selected_drug = None if pick == "(None)" else pick
+
+    if not selected_drug:
+        return
 
-visible_drugs = results_df["drug"].dropna().unique().tolist()
-pick = st.selectbox("Druglist", ["(None)"] + visible_drugs)
-selected_drug = None if pick == "(None)" else pick
+    prr, prr_src = get_prr()
+    if prr.empty:
+        return
 
-if selected_drug:
     # Try to find CUI for the selected drug from smr3 (any age row is fine)
-    cui_val = (
-        smr.loc[smr["drug"] == selected_drug, "cui"]
-        .dropna()
-        .astype(str)
-        .str.strip()
-        .head(1)
-        .tolist()
-    )
-    cui_val = cui_val[0] if cui_val else None
-
-    if age_choice == "Total":
-        # Show all pediatric ADE rows for that drug
-        if cui_val:
-            ade_df = prr[prr["cui"] == cui_val].copy()
+    cui_val = build_drug_cui_map(smr).get(selected_drug)
+
+    if cui_val:
+        if duckdb is not None:
+            order = " ORDER BY prr DESC NULLS LAST" if "prr" in prr.columns else ""
+            ade_df = (
+                ade_lookup_con(prr)
+                .execute(
+                    f"SELECT * FROM prr_t WHERE cui = ? AND (? = 'Total' OR agegroup = ?){order}",
+                    [cui_val, age_choice, age_choice],
+                )
+                .to_arrow_table()
+                .to_pandas(types_mapper=pd.ArrowDtype)
+            )
         else:
-            ade_df = prr[prr["drug"].str.casefold() == selected_drug.casefold()].copy()
-        subtitle = f"{selected_drug} — All pediatric ages"
+            prr_idx = index_prr(prr)
+            try:
+                hit = prr_idx.loc[[cui_val]] if age_choice == "Total" else prr_idx.loc[[(cui_val, age_choice)]]
+                ade_df = hit.reset_index()
+            except KeyError:
+                ade_df = prr.iloc[0:0]
+    elif age_choice == "Total":
+        # Show all pediatric ADE rows for that drug
+        ade_df = prr[prr["drug_lower"] == selected_drug.casefold()]
     else:
-        if cui_val:
-            ade_df = prr[(prr["cui"] == cui_val) & (prr["agegroup"] == age_choice)].copy()
-        else:
-            ade_df = prr[(prr["drug"].str.casefold() == selected_drug.casefold()) & (prr["agegroup"] == age_choice)].copy()
-        subtitle = f"{selected_drug} — {age_choice}"
+        ade_df = prr[(prr["drug_lower"] == selected_drug.casefold()) & (prr["agegroup"] == age_choice)]
+
+    subtitle = f"{selected_drug} — All pediatric ages" if age_choice == "Total" else f"{selected_drug} — {age_choice}"
 
     if ade_df.empty:
         st.info(f"No ADE data for **{subtitle}**.")
-    else:
-        # prr3 columns: pt, prr, ror, ic, ebgm (and agegroup)
-        cols_to_show = [c for c in ["agegroup", "pt", "prr", "ror", "ic", "ebgm"] if c in ade_df.columns]
-        if "prr" in ade_df.columns:
-            ade_df = ade_df.sort_values("prr", ascending=False, na_position="last")
-        st.markdown(f"#### {subtitle}")
-        ade_view = ade_df[cols_to_show]
+        return
+
+    # prr3 columns: pt, prr, ror, ic, ebgm (and agegroup)
+    cols_to_show = [c for c in ["agegroup", "pt", "prr", "ror", "ic", "ebgm"] if c in ade_df.columns]
+    if "prr" in ade_df.columns:
+        ade_df = ade_df.sort_values("prr", ascending=False, na_position="last")
+    st.markdown(f"#### {subtitle}")
+    ade_view = ade_df[cols_to_show]
 
     # ------------------------
     # TOOLTIPS TO EACH ADE DATAVIEW COLUMN
     # -------------------------
-        st.dataframe(ade_view,
-                         width='stretch',
-                         hide_index=True,
-                         column_config={
-                             "pt": st.column_config.Column(
-                                 "pt",
-                                 help = "Reported ADE"
-                             ),
-                             "ror": st.column_config.Column(
-                                 "ror",
-                                 help = "Reporting Odds Ratio"
-                             ),
-                             "prr": st.column_config.Column(
-                                 "prr",
-                                 help = "Proportional Reporting Ratio"
-                             ),
-                             "ic": st.column_config.Column(
-                                 "ic",
-                                 help = "Information Component"
-                             ),
-                             "ebgm": st.column_config.Column(
-                                 "ebgmn",
-                                 help = "Empirical Bayesian Geometric Mean"
-                             )
-                         }
-                    )
+    st.dataframe(ade_view,
+                     width='stretch',
+                     hide_index=True,
+                     column_config={
+                         "pt": st.column_config.Column(
+                             "pt",
+                             help = "Reported ADE"
+                         ),
+                         "ror": st.column_config.Column(
+                             "ror",
+                             help = "Reporting Odds Ratio"
+                         ),
+                         "prr": st.column_config.Column(
+                             "prr",
+                             help = "Proportional Reporting Ratio"
+                         ),
+                         "ic": st.column_config.Column(
+                             "ic",
+                             help = "Information Component"
+                         ),
+                         "ebgm": st.column_config.Column(
+                             "ebgmn",
+                             help = "Empirical Bayesian Geometric Mean"
+                         )
+                     }
+                )
     #-----------------
     # Download ADE CSV
     #-----------------
     ade_fname = f"rweeye_ade_{selected_drug.replace(' ', '_')}_{age_choice.replace(' ', '_')}_{ts}.csv"
     st.download_button(
         label="⬇️ Download ADE CSV",
-        data=ade_view.to_csv(index=False).encode("utf-8"),
+        data=to_csv_bytes(ade_view),
         file_name=ade_fname,
         mime="text/csv",
     )
 
+st.markdown("---")
+render_ade_panel(results_df, age_choice, ts)
+
 # -----------------------
 # Debug info
 # Hide this code from users
@@ -331,7 +519,6 @@ if selected_drug:
 if False:
     with st.expander("ⓘ Data info / Debug"):
         st.write(f"SMR3 path: {smr_src}")
-        st.write(f"PRR3 path: {prr_src}")
         st.write("SMR rows (after is_first==1):", len(smr))
-        st.write("PRR rows:", len(prr))
         st.write("Filtered rows:", len(df))
+        # prr is lazy-loaded inside the ADE panel; see get_prr()